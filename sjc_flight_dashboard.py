@@ -1,9 +1,12 @@
 import streamlit as st
-import requests
+import httpx
+import orjson
+import ijson
+import asyncio
 import math
+import numpy as np
 from datetime import datetime
 from zoneinfo import ZoneInfo
-from streamlit_autorefresh import st_autorefresh
 import os
 import time
 
@@ -12,6 +15,12 @@ HOME_LAT = 37.399746   # your home latitude
 HOME_LON = -121.962585  # your home longitude
 MAX_DISTANCE_KM = 3.2  # 2 miles
 
+# Bounding box half-widths (degrees) around home, used to cheaply reject far flights
+LAT_HALF = MAX_DISTANCE_KM / 111.0
+LON_HALF = MAX_DISTANCE_KM / (111.0 * math.cos(math.radians(HOME_LAT)))
+LAMIN, LAMAX = HOME_LAT - LAT_HALF, HOME_LAT + LAT_HALF
+LOMIN, LOMAX = HOME_LON - LON_HALF, HOME_LON + LON_HALF
+
 # Airline code lookup (callsign prefixes)
 AIRLINE_CODES = {
     "UAL": "United Airlines",
@@ -98,43 +107,78 @@ ICAO_TO_CITY = {
     "RJAA": "Tokyo–Narita",
 }
 
+# Card labels built once so the per-flight lookup is a single short-circuit expression
+ARRIVAL_LABELS = {icao: f"To {city}" for icao, city in ICAO_TO_CITY.items()}
+DEPARTURE_LABELS = {icao: f"From {city}" for icao, city in ICAO_TO_CITY.items()}
+
 # ==== AUTH CONFIG ====
 # No authentication (use free OpenSky API, subject to rate limits)
 
 # ==== FUNCTIONS ====
 
-def haversine(lat1, lon1, lat2, lon2):
+# Home point trig terms, folded once instead of per distance call
+_HOME_LAT_RAD = math.radians(HOME_LAT)
+_HOME_LON_RAD = math.radians(HOME_LON)
+_COS_HOME = math.cos(_HOME_LAT_RAD)
+
+def haversine_from_home(lats, lons):
+    """Vectorized haversine distance (km) from home to arrays of lats/lons."""
     R = 6371
-    dlat = math.radians(lat2 - lat1)
-    dlon = math.radians(lon2 - lon1)
-    a = math.sin(dlat/2)**2 + math.cos(math.radians(lat1)) * math.cos(math.radians(lat2)) * math.sin(dlon/2)**2
-    return R * 2 * math.atan2(math.sqrt(a), math.sqrt(1-a))
+    lat_rad = np.radians(lats)
+    dlat = lat_rad - _HOME_LAT_RAD
+    dlon = np.radians(lons) - _HOME_LON_RAD
+    a = np.sin(dlat/2)**2 + _COS_HOME * np.cos(lat_rad) * np.sin(dlon/2)**2
+    return R * 2 * np.arctan2(np.sqrt(a), np.sqrt(1-a))
 
-def get_flights():
-    import time
-    now = time.time()
-    cache_key = "flight_cache"
-    cache_time_key = "flight_cache_time"
-    cache_ttl = 30  # seconds
-    if cache_key in st.session_state and cache_time_key in st.session_state:
-        if now - st.session_state[cache_time_key] < cache_ttl:
-            return st.session_state[cache_key]
+# Shared by the sync and async clients; HTTP/2 multiplexes requests over one connection
+HTTP_OPTIONS = {"http2": True, "timeout": 10, "headers": {"User-Agent": "sjc-dash"}}
+
+@st.cache_resource
+def _http():
+    """Shared HTTP client so connections are reused across reruns and users."""
+    return httpx.Client(**HTTP_OPTIONS)
+
+def _stream_states_in_box():
+    """Stream-parse the global /states/all feed, keeping only rows inside the home box."""
     url = "https://opensky-network.org/api/states/all"
+    flights = []
+    states = ijson.sendable_list()
+    parser = ijson.items_coro(states, "states.item", use_float=True)
+    with _http().stream("GET", url) as r:
+        r.raise_for_status()
+        for chunk in r.iter_bytes():
+            parser.send(chunk)
+            flights.extend(
+                f for f in states
+                if f[5] is not None and f[6] is not None
+                and LAMIN <= f[6] <= LAMAX and LOMIN <= f[5] <= LOMAX
+            )
+            del states[:]
+    parser.close()
+    return flights
+
+@st.cache_data(ttl=30, show_spinner=False)
+def get_flights():
+    # Ask OpenSky for the home bounding box only rather than every aircraft worldwide
+    url = f"https://opensky-network.org/api/states/all?lamin={LAMIN}&lomin={LOMIN}&lamax={LAMAX}&lomax={LOMAX}"
     try:
-        r = requests.get(url, timeout=10)
+        r = _http().get(url)
         r.raise_for_status()
-        flights = r.json().get("states", [])
-        st.session_state[cache_key] = flights
-        st.session_state[cache_time_key] = now
-        return flights
+        # "states" is null when the box is empty
+        return orjson.loads(r.content).get("states") or []
+    except httpx.HTTPStatusError as e:
+        # Fall back only when the bbox query itself was refused; a 429 applies to the global feed too
+        if e.response.status_code == 429:
+            st.error(f"Error fetching flight data: {e}")
+            return []
+    except Exception as e:
+        st.error(f"Error fetching flight data: {e}")
+        return []
+    try:
+        return _stream_states_in_box()
     except Exception as e:
         st.error(f"Error fetching flight data: {e}")
         return []
-
-def is_near_home(lat, lon):
-    if lat is None or lon is None:
-        return False
-    return haversine(HOME_LAT, HOME_LON, lat, lon) <= MAX_DISTANCE_KM
 
 def is_sjc_flight(callsign):
     # This function is not useful as flight callsigns don't contain airport codes
@@ -142,89 +186,164 @@ def is_sjc_flight(callsign):
     return False
 
 def extract_details(callsign, icao24):
-    cs = callsign.strip() if callsign else ""
-    airline_code = cs[:3]
-    flight_number = cs[3:].strip() if len(cs) > 3 else "Unknown"
+    # OpenSky callsigns are already uppercase and right-padded, so slice the raw field
+    # and only trim the padding off each piece
+    cs = callsign or ""
+    airline_code = cs[:3].rstrip()
+    flight_number = cs[3:].strip() or "Unknown"
     airline = AIRLINE_CODES.get(airline_code, "Private")
 
     # destination is now handled in the main loop using get_flight_route and ICAO_TO_CITY
 
-    aircraft_type = "Unknown Type"
-    for prefix, type_name in AIRCRAFT_TYPES.items():
-        if prefix in cs:
-            aircraft_type = type_name
-            break
+    # No metadata lookup here, so only an exact type code token in the callsign is recognised
+    tokens = cs.split()
+    aircraft_type = AIRCRAFT_TYPES.get(tokens[-1], "Unknown Type") if tokens else "Unknown Type"
 
     return airline, f"{airline_code}{flight_number}", aircraft_type
 
-def lookup_aircraft_type(icao24):
-    """Lookup aircraft type/model from OpenSky aircraft database using icao24. Cache results in session state."""
-    if not icao24:
-        return "Unknown Type"
-    cache_key = f"aircraft_type_{icao24}"
-    if cache_key in st.session_state:
-        return st.session_state[cache_key]
+NEGATIVE_TTL = 10 * 60  # seconds before a failed metadata/route lookup is retried
+
+@st.cache_data(ttl=24 * 60 * 60, show_spinner=False)
+def _fetch_aircraft_type(icao24):
+    # Errors propagate so that failed lookups are not cached
     url = f"https://opensky-network.org/api/metadata/aircraft/icao24/{icao24}"
+    r = _http().get(url)
+    r.raise_for_status()
+    data = r.json()
+    # Prefer our name for the ICAO type code, then the reported model or type
+    fallback = data.get("model") or data.get("type") or "Unknown Type"
+    return AIRCRAFT_TYPES.get(data.get("typecode"), fallback)
+
+@st.cache_data(ttl=NEGATIVE_TTL, show_spinner=False)
+def _try_aircraft_type(icao24):
+    # Caches failures (None) for NEGATIVE_TTL; successes are also held for 24h by _fetch_aircraft_type
     try:
-        r = requests.get(url, timeout=10)
-        r.raise_for_status()
-        data = r.json()
-        # Try to get model or type
-        ac_type = data.get("model") or data.get("type") or "Unknown Type"
-        st.session_state[cache_key] = ac_type
-        return ac_type
+        return _fetch_aircraft_type(icao24)
     except Exception:
+        return None
+
+def lookup_aircraft_type(icao24):
+    """Lookup aircraft type/model from OpenSky aircraft database using icao24. Results are cached across sessions."""
+    if not icao24:
         return "Unknown Type"
+    return _try_aircraft_type(icao24) or "Unknown Type"
 
-def get_flight_route(icao24):
-    import time
+ROUTE_TTL = 24 * 60 * 60  # seconds
+ROUTE_CONCURRENCY = 8
+
+@st.cache_resource
+def _route_store():
+    """Process-wide route cache: icao24 -> (expires_at, (dep, arr))."""
+    return {}
+
+async def _fetch_json(client, sem, limits, url):
+    """GET a URL as JSON, giving up as soon as any request in the batch has been rate limited."""
+    async with sem:
+        if limits.get("remaining") == 0:
+            raise RuntimeError("OpenSky rate limit exhausted")
+        r = await client.get(url)
+        remaining = r.headers.get("X-Rate-Limit-Remaining")
+        if remaining is not None:
+            limits["remaining"] = int(remaining)
+        if r.status_code == 429:
+            # The anonymous quota is a daily credit budget, so retrying soon can't succeed;
+            # stop the sibling tasks too
+            limits["remaining"] = 0
+            retry_after = r.headers.get("X-Rate-Limit-Retry-After-Seconds", "unknown")
+            raise RuntimeError(f"OpenSky rate limited, retry after {retry_after}s")
+        r.raise_for_status()
+        return r.json()
+
+async def _fetch_route(client, sem, limits, icao24):
     now = int(time.time())
     begin = now - 2 * 3600  # last 2 hours
     end = now
-    cache_key = f"route_{icao24}"
-    if cache_key in st.session_state:
-        return st.session_state[cache_key]
     url = f"https://opensky-network.org/api/flights/aircraft?icao24={icao24}&begin={begin}&end={end}"
-    try:
-        r = requests.get(url, timeout=10)
-        r.raise_for_status()
-        flights = r.json()
-        if flights:
-            flight = flights[-1]  # most recent
-            dep = flight.get('estDepartureAirport')
-            arr = flight.get('estArrivalAirport')
-            st.session_state[cache_key] = (dep, arr)
-            return dep, arr
-    except Exception as e:
-        return None, None
-    return None, None
+    flights = await _fetch_json(client, sem, limits, url)
+    if not flights:
+        raise LookupError(f"No recent flights for {icao24}")
+    flight = flights[-1]  # most recent
+    return flight.get('estDepartureAirport'), flight.get('estArrivalAirport')
+
+async def _bulk_routes(icao24s):
+    sem = asyncio.Semaphore(ROUTE_CONCURRENCY)
+    limits = {}
+    # Bound to this event loop, so created per call rather than cached like _http()
+    async with httpx.AsyncClient(**HTTP_OPTIONS) as client:
+        return await asyncio.gather(
+            *[_fetch_route(client, sem, limits, i) for i in icao24s],
+            return_exceptions=True,
+        )
+
+def get_flight_routes(icao24s):
+    """Return {icao24: (dep, arr)}, fetching all uncached routes concurrently. Failed lookups are cached for NEGATIVE_TTL."""
+    store = _route_store()
+    now = time.time()
+    routes = {}
+    missing = []
+    # dict.fromkeys dedupes while keeping order, so each icao24 is fetched at most once
+    for icao24 in dict.fromkeys(icao24s):
+        entry = store.get(icao24)
+        if entry and entry[0] > now:
+            routes[icao24] = entry[1]
+        else:
+            missing.append(icao24)
+    if missing:
+        results = asyncio.run(_bulk_routes(missing))
+        # Drop expired entries so aircraft that never reappear don't stay in memory
+        for icao24, (expires_at, _) in list(store.items()):
+            if expires_at <= now:
+                store.pop(icao24, None)
+        for icao24, result in zip(missing, results):
+            if isinstance(result, Exception):
+                store[icao24] = (now + NEGATIVE_TTL, (None, None))
+                routes[icao24] = (None, None)
+            else:
+                store[icao24] = (now + ROUTE_TTL, result)
+                routes[icao24] = result
+    return routes
+
+def get_flight_route(icao24):
+    return get_flight_routes([icao24])[icao24]
 
 # ==== UI ====
 
 st.set_page_config(page_title="Flights Overhead from SJC", layout="centered")
 st.title("🛫 Flights Overhead")
-now_pst = datetime.now(ZoneInfo("America/Los_Angeles"))
-st.caption(f"Live from SJC | {now_pst.strftime('%Y-%m-%d %I:%M:%S %p')} PST")
-
-flights = get_flights()
-
-visible = []
-
-for f in flights:
-    callsign = f[1]
-    icao24 = f[0]
-    lon, lat = f[5], f[6]
-    on_ground = f[8]
-
-    if lat and lon and is_near_home(lat, lon):
-        dep, arr = get_flight_route(icao24)
-        label = None
-        if arr and arr in ICAO_TO_CITY:
-            label = f"To {ICAO_TO_CITY[arr]}"
-        elif dep and dep in ICAO_TO_CITY:
-            label = f"From {ICAO_TO_CITY[dep]}"
-        else:
-            label = callsign or "Unknown Flight"
+
+FLIGHT_CARD = """
+<div style="padding:15px; margin-bottom:15px; border-radius:10px; background-color:#343434;">
+    <div style="font-size:2rem; font-weight:bold;">{CityLabel}</div>
+    <div style="font-size:1rem;">{Airline} | {Flight Number}</div>
+    <div style="font-size:1rem;">{Aircraft Type}</div>
+</div>
+"""
+
+@st.fragment(run_every="30s")
+def flight_panel():
+    """Live flight cards; reruns on its own every 30s without rerunning the whole page."""
+    now_pst = datetime.now(ZoneInfo("America/Los_Angeles"))
+    st.caption(f"Live from SJC | {now_pst.strftime('%Y-%m-%d %I:%M:%S %p')} PST")
+
+    flights = get_flights()
+
+    visible = []
+
+    near = []
+    if flights:
+        # Columnar view of the state vectors, keeping only the fields we use
+        icao24s, callsigns, _, _, _, lons, lats, *_ = zip(*flights)
+        lons = np.array(lons, dtype=np.float64)  # missing positions become NaN
+        lats = np.array(lats, dtype=np.float64)
+        # OpenSky already returns only the bounding box, so just trim its corners (NaN never passes)
+        idx = np.flatnonzero(haversine_from_home(lats, lons) <= MAX_DISTANCE_KM)
+        near = [(icao24s[i], callsigns[i]) for i in idx]
+
+    routes = get_flight_routes([icao24 for icao24, _ in near])
+
+    for icao24, callsign in near:
+        dep, arr = routes[icao24]
+        label = ARRIVAL_LABELS.get(arr) or DEPARTURE_LABELS.get(dep) or callsign or "Unknown Flight"
         airline, flight_no, ac_type = extract_details(callsign, icao24)
         visible.append({
             "CityLabel": label,
@@ -233,21 +352,17 @@ for f in flights:
             "Aircraft Type": ac_type
         })
 
-if visible:
-    for flight in visible:
-        st.markdown(f"""
-        <div style="padding:15px; margin-bottom:15px; border-radius:10px; background-color:#343434;">
-            <div style="font-size:2rem; font-weight:bold;">{flight['CityLabel']}</div>
-            <div style="font-size:1rem;">{flight['Airline']} | {flight['Flight Number']}</div>
-            <div style="font-size:1rem;">{flight['Aircraft Type']}</div>
+    if visible:
+        # One markdown element for all cards instead of one per flight
+        st.markdown("".join(FLIGHT_CARD.format(**flight) for flight in visible), unsafe_allow_html=True)
+    else:
+        st.markdown("""
+        <div style="padding:20px; margin-top:20px; text-align:left; font-size:1.5rem; color:#555;">
+            🌤️ Clear skies!
         </div>
         """, unsafe_allow_html=True)
-else:
-    st.markdown("""
-    <div style="padding:20px; margin-top:20px; text-align:left; font-size:1.5rem; color:#555;">
-        🌤️ Clear skies!
-    </div>
-    """, unsafe_allow_html=True)
+
+flight_panel()
 
 st.markdown("""
 <style>